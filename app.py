@@ -1,16 +1,40 @@
 import streamlit as st
 import pandas as pd
-from sqlalchemy import create_engine, text
-from sqlalchemy.orm import sessionmaker
+import pyarrow as pa
+from sqlalchemy import text
 import google.generativeai as genai
 from dotenv import load_dotenv
 import os
+import io
 import json
-from database import Database, Base
+import asyncio
+import hashlib
+import logging
+import queue
+import re
+import threading
+import time
+import sqlglot
+from sqlglot import exp
+from typing import TypedDict
+from cachetools import TTLCache
+from database import Database, make_engine
+from background_loop import get_event_loop
 
 # Load environment variables
 load_dotenv()
 
+logger = logging.getLogger(__name__)
+
+# Per-attempt Gemini timeouts (seconds): until the first streamed chunk, and
+# for the whole stream; plus the number of hedged parallel attempts
+GEMINI_TIMEOUT = 15
+GEMINI_STREAM_TIMEOUT = 120
+GEMINI_ATTEMPTS = 2
+
+# Upper bound on rows pulled into pandas for any generated query
+MAX_RESULT_ROWS = 1000
+
 # Configure Gemini
 GEMINI_API_KEY = os.getenv('GEMINI_API_KEY')
 if not GEMINI_API_KEY:
@@ -19,10 +43,65 @@ if not GEMINI_API_KEY:
 
 genai.configure(api_key=GEMINI_API_KEY)
 
-# Initialize database
-db = Database('sqlite:///health_insurance.db')
-engine = create_engine('sqlite:///health_insurance.db')
-Session = sessionmaker(bind=engine)
+@st.cache_resource
+def get_engine():
+    """Create the SQLAlchemy engine once per process"""
+    return make_engine('sqlite:///health_insurance.db')
+
+@st.cache_resource(show_spinner="Initializing database with sample data...")
+def ensure_db():
+    """Create the database on first use and return a handle to it"""
+    db = Database(engine=get_engine())
+    is_new = not os.path.exists('health_insurance.db')
+    db.init_db()
+    if is_new:
+        db.create_sample_data(50)
+    return db
+
+def reset_database(db, progress):
+    """Rebuild the sample data; run on a background thread and report through progress.
+    
+    Cached query results are cleared here, before progress is updated, so no
+    session keeps serving pre-reset data even if the one that started the
+    reset never reruns.
+    """
+    try:
+        db.drop_tables()
+        db.init_db()
+        db.create_sample_data(50)
+        _run_query.clear()
+        progress['state'] = 'done'
+    except Exception as e:
+        _run_query.clear()
+        progress['error'] = str(e)
+        progress['state'] = 'error'
+
+@st.cache_resource
+def get_sql_cache():
+    """Generated answers keyed by normalized prompt, so repeat questions skip Gemini.
+    
+    Held as a cached resource because Streamlit re-executes this script as a
+    fresh module on every rerun, which would reset a module-level cache.
+    """
+    return TTLCache(maxsize=512, ttl=600)
+
+@st.cache_resource
+def get_readonly_engine():
+    """Create a read-only engine for running generated SQL"""
+    return make_engine('sqlite:///file:health_insurance.db?mode=ro&uri=true')
+
+@st.cache_resource
+def get_gemini_model():
+    """Create the Gemini model handle once per process.
+    
+    The schema rides in the system instruction, giving every request the same
+    prefix for Gemini's implicit prompt caching; it is too small for an
+    explicit context cache.
+    """
+    return genai.GenerativeModel(
+        'gemini-2.5-flash',
+        system_instruction=f"{SQL_SYSTEM_INSTRUCTION}\n\n{SCHEMA_INFO}"
+    )
 
 # Initialize session state
 if 'messages' not in st.session_state:
@@ -50,48 +129,235 @@ Relationships:
 - claims.customer_id -> customers.customer_id
 """
 
-def generate_sql(natural_language_query):
-    """Generate SQL query from natural language using Gemini 2.5 Flash"""
+SQL_SYSTEM_INSTRUCTION = "You are a SQL expert. Write SQLite queries against the database schema you are given."
+
+# Fixed parts of the per-question prompt, built once so every request shares a
+# byte-identical template around the user's question
+_PROMPT_PREFIX = "Write a SQL query to: "
+_PROMPT_SUFFIX = (
+    "\n\nReturn a JSON object with two fields: \"sql\", containing only the SQL query "
+    "without markdown formatting, and \"explanation\", one or two sentences "
+    "describing what the query returns."
+)
+
+class SqlAnswer(TypedDict):
+    sql: str
+    explanation: str
+
+# SQL and its explanation come back together as JSON from a single request
+SQL_GENERATION_CONFIG = genai.GenerationConfig(
+    response_mime_type="application/json",
+    response_schema=SqlAnswer
+)
+
+# Markdown code fence the model sometimes wraps its SQL in
+_FENCE_RE = re.compile(r"```(?:sql)?\n?(.*?)```", re.DOTALL)
+
+def _strip_fence(text_response):
+    match = _FENCE_RE.search(text_response)
+    return (match.group(1) if match else text_response).strip()
+
+def parse_answer(text_response):
+    """Pull the SQL and explanation out of the model's JSON reply"""
     try:
-        # Using Gemini 2.5 Flash model
-        model = genai.GenerativeModel('gemini-2.5-flash')
-        
-        prompt = f"""You are a SQL expert. Given the following database schema:
-        
-        {SCHEMA_INFO}
-        
-        Write a SQL query to: {natural_language_query}
-        
-        Return ONLY the SQL query, nothing else. Do not include any explanations or markdown formatting.
-        """
-        
-        response = model.generate_content(prompt)
-        sql_query = response.text.strip()
-        
-        # Clean up the response to extract just the SQL
-        if '```sql' in sql_query:
-            sql_query = sql_query.split('```sql')[1].split('```')[0].strip()
-        elif '```' in sql_query:
-            sql_query = sql_query.split('```')[1].strip()
-            if sql_query.startswith('sql\n'):
-                sql_query = sql_query[4:].strip()
-        
-        return sql_query
+        answer = json.loads(text_response)
+    except ValueError:
+        # Fall back to treating the reply as bare SQL
+        return {"sql": _strip_fence(text_response), "explanation": ""}
+    if not isinstance(answer, dict) or not isinstance(answer.get("sql"), str):
+        raise ValueError("The model's reply did not include a SQL query")
+    return {"sql": _strip_fence(answer["sql"]), "explanation": (answer.get("explanation") or "").strip()}
+
+async def _stream_sql(model, prompt, on_text):
+    """Stream a Gemini response, reporting the text received so far after each chunk.
+    
+    Only the wait for the first chunk is bounded by GEMINI_TIMEOUT, so long
+    replies that are already streaming are not cut off.
+    """
+    async def first_chunk():
+        response = await model.generate_content_async(prompt, stream=True, generation_config=SQL_GENERATION_CONFIG)
+        chunks = response.__aiter__()
+        try:
+            return chunks, await chunks.__anext__()
+        except StopAsyncIteration:
+            return chunks, None
+    
+    chunks, chunk = await asyncio.wait_for(first_chunk(), timeout=GEMINI_TIMEOUT)
+    parts = []
+    while chunk is not None:
+        parts.append(chunk.text)
+        on_text("".join(parts))
+        try:
+            chunk = await chunks.__anext__()
+        except StopAsyncIteration:
+            chunk = None
+    return "".join(parts)
+
+async def _request_sql(model, prompt, on_text):
+    """Issue a single streamed Gemini request, bounded by GEMINI_STREAM_TIMEOUT overall"""
+    return await asyncio.wait_for(_stream_sql(model, prompt, on_text), timeout=GEMINI_STREAM_TIMEOUT)
+
+async def _request_sql_hedged(model, prompt, on_text=None):
+    """Fire hedged attempts in parallel and keep whichever succeeds first.
+    
+    Partial output is forwarded to on_text from whichever attempt streams first.
+    """
+    leader = []
+    
+    def follow(attempt):
+        def forward(text_so_far):
+            if not leader:
+                leader.append(attempt)
+            if on_text is not None and leader[0] == attempt:
+                on_text(text_so_far)
+        return forward
+    
+    tasks = [asyncio.create_task(_request_sql(model, prompt, follow(attempt))) for attempt in range(GEMINI_ATTEMPTS)]
+    try:
+        error = None
+        for next_done in asyncio.as_completed(tasks):
+            try:
+                return await next_done
+            except Exception as e:
+                error = e
+        raise error
+    finally:
+        for task in tasks:
+            task.cancel()
+
+async def generate_sql_async(model, sql_cache, natural_language_query, on_text=None):
+    """Generate a SQL query and its explanation from natural language using Gemini 2.5 Flash"""
+    key = hashlib.sha1(natural_language_query.strip().lower().encode()).hexdigest()
+    cached = sql_cache.get(key)
+    if cached is not None:
+        logger.info("SQL cache hit for %s", key)
+        return cached
+    logger.info("SQL cache miss for %s", key)
+    
+    # The schema lives in the model's system instruction, so only the question is sent
+    prompt = _PROMPT_PREFIX + natural_language_query + _PROMPT_SUFFIX
+    
+    text_response = await _request_sql_hedged(model, prompt, on_text)
+    answer = parse_answer(text_response)
+    sql_cache[key] = answer
+    return answer
+
+def warm_up_database(engine):
+    """Open a pooled read-only connection so the first query doesn't pay for it"""
+    try:
+        with engine.connect() as conn:
+            conn.execute(text("SELECT 1"))
+    except Exception as e:
+        # Best effort only; execute_query reports real connection errors
+        logger.info("Database warm-up failed: %s", e)
+
+async def handle_prompt(model, sql_cache, readonly_engine, natural_language_query, on_text=None):
+    """Generate SQL while warming up the database connection in a worker thread"""
+    loop = asyncio.get_running_loop()
+    warm_up = loop.run_in_executor(None, warm_up_database, readonly_engine)
+    sql_query, _ = await asyncio.gather(
+        generate_sql_async(model, sql_cache, natural_language_query, on_text),
+        warm_up
+    )
+    return sql_query
+
+def _run_prompt(model, sql_cache, readonly_engine, natural_language_query, placeholder):
+    """Run handle_prompt on the shared event loop and block for its result.
+    
+    Streamed partial output is passed back through a queue, since only the
+    script thread may update Streamlit elements, and drawn into placeholder.
+    """
+    partial = queue.Queue()
+    future = asyncio.run_coroutine_threadsafe(
+        handle_prompt(model, sql_cache, readonly_engine, natural_language_query, partial.put),
+        get_event_loop()
+    )
+    while not future.done() or not partial.empty():
+        try:
+            text_so_far = partial.get(timeout=0.05)
+        except queue.Empty:
+            continue
+        if placeholder is not None:
+            placeholder.code(text_so_far, language="json")
+    return future.result()
+
+def generate_sql(natural_language_query, placeholder=None):
+    """Blocking wrapper around handle_prompt for the Streamlit script thread.
+    
+    Cached resources are resolved here rather than in the coroutines, since
+    st.cache_resource needs the script run context on a cache miss.
+    """
+    sql_cache = get_sql_cache()
+    readonly_engine = get_readonly_engine()
+    try:
+        return _run_prompt(get_gemini_model(), sql_cache, readonly_engine, natural_language_query, placeholder)
+    except (asyncio.TimeoutError, TimeoutError):
+        st.error("Error generating SQL: Gemini did not respond in time. Please try again.")
+        return None
     except Exception as e:
         st.error(f"Error generating SQL: {str(e)}")
         return None
 
-def execute_query(query):
-    """Execute SQL query and return results as a DataFrame"""
+def limit_query(query):
+    """Check that query is a single read statement and cap its row count"""
+    statements = sqlglot.parse(query, read='sqlite')
+    if len(statements) != 1 or statements[0] is None:
+        raise ValueError("Only a single SQL statement can be run")
+    parsed = statements[0]
+    if not isinstance(parsed, exp.Query):
+        raise ValueError("Only SELECT queries can be run")
+    # Wrap the original text rather than sqlglot's rewrite, which would change
+    # the headers of unaliased expressions (e.g. IFNULL -> COALESCE); the
+    # newline keeps a trailing -- comment from swallowing the closing paren
+    return f"SELECT * FROM ({query.strip().rstrip(';')}\n) LIMIT {MAX_RESULT_ROWS}"
+
+@st.cache_data(ttl=300, max_entries=128, show_spinner=False)
+def _run_query(query: str) -> pd.DataFrame:
+    # Errors propagate so st.cache_data never memoizes a failure
+    limited_query = limit_query(query)
+    with get_readonly_engine().connect() as conn:
+        return pd.read_sql_query(text(limited_query), conn)
+
+def execute_query(query: str) -> pd.DataFrame:
+    """Execute SQL query and return results as a DataFrame.
+    
+    On failure an empty DataFrame is returned with the message in attrs["error"].
+    """
     try:
-        with engine.connect() as conn:
-            result = conn.execute(text(query))
-            rows = result.fetchall()
-            columns = result.keys()
-            return pd.DataFrame(rows, columns=columns)
+        return _run_query(query)
     except Exception as e:
-        st.error(f"Error executing query: {str(e)}")
-        return None
+        df = pd.DataFrame()
+        df.attrs["error"] = f"Error executing query: {str(e)}"
+        return df
+
+def encode_results(df):
+    """Parquet-encode a result for chat history to keep it compact.
+    
+    SQLite columns can mix types, which Arrow rejects; those frames are kept
+    as-is so the turn is still recorded.
+    """
+    try:
+        return df.to_parquet()
+    except pa.ArrowException:
+        return df
+
+def decode_results(stored):
+    """Inverse of encode_results"""
+    if isinstance(stored, bytes):
+        return pd.read_parquet(io.BytesIO(stored))
+    return stored
+
+def display_results(df):
+    """Render a query result DataFrame with quick statistics"""
+    if not df.empty:
+        st.dataframe(df, use_container_width=True)
+        
+        # Show some basic stats if the result is numeric
+        if len(df.select_dtypes(include=['number']).columns) > 0:
+            with st.expander("Quick Statistics"):
+                st.dataframe(df.describe())
+    else:
+        st.info("No results found.")
 
 def display_sql_examples():
     """Display example queries"""
@@ -120,15 +386,14 @@ def main():
     st.markdown("Ask questions about your health insurance data in natural language")
     
     # Initialize database if needed
-    if not os.path.exists('health_insurance.db'):
-        with st.spinner("Initializing database with sample data..."):
-            db.init_db()
-            db.create_sample_data(50)
+    db = ensure_db()
     
     # Display chat messages
     for message in st.session_state.messages:
         with st.chat_message(message["role"]):
             st.markdown(message["content"])
+            if message.get("df") is not None:
+                display_results(decode_results(message["df"]))
     
     # Sidebar with database info and examples
     with st.sidebar:
@@ -144,12 +409,24 @@ def main():
         - Prospects
         """)
         
-        if st.button("Reset Database"):
-            with st.spinner("Resetting database..."):
-                db.drop_tables()
-                db.init_db()
-                db.create_sample_data(50)
-                st.success("Database reset with sample data")
+        reset_progress = st.session_state.get('reset_progress')
+        if reset_progress is None:
+            if st.button("Reset Database"):
+                reset_progress = st.session_state.reset_progress = {'state': 'running'}
+                threading.Thread(target=reset_database, args=(db, reset_progress), daemon=True).start()
+        if reset_progress is not None:
+            if reset_progress['state'] == 'running':
+                st.info("Resetting database...")
+            else:
+                del st.session_state.reset_progress
+                if reset_progress['state'] == 'done':
+                    st.success("Database reset with sample data")
+                else:
+                    st.error(f"Error resetting database: {reset_progress['error']}")
+        
+        if st.button("Clear cache"):
+            _run_query.clear()
+            st.success("Query cache cleared")
         
         display_sql_examples()
     
@@ -161,34 +438,51 @@ def main():
             st.markdown(prompt)
         
         with st.chat_message("assistant"):
-            st.markdown("Generating SQL query...")
-            sql_query = generate_sql(prompt)
+            with st.status("Thinking...", expanded=True) as status:
+                st.write("Generating SQL query...")
+                answer = generate_sql(prompt, st.empty())
+                sql_query = answer["sql"] if answer else None
+                if sql_query:
+                    st.write("Running query...")
+                    df = execute_query(sql_query)
+                    query_error = df.attrs.get("error")
+                    if query_error:
+                        status.update(label="Query failed", state="error", expanded=False)
+                    else:
+                        status.update(label="Done", state="complete", expanded=False)
+                else:
+                    status.update(label="Failed", state="error")
             
             if sql_query:
+                if answer["explanation"]:
+                    st.markdown(answer["explanation"])
+                
                 st.markdown("**Generated SQL:**")
                 st.code(sql_query, language="sql")
                 
                 st.markdown("**Results:**")
-                df = execute_query(sql_query)
-                
-                if df is not None:
-                    if not df.empty:
-                        st.dataframe(df, use_container_width=True)
-                        
-                        # Show some basic stats if the result is numeric
-                        if len(df.select_dtypes(include=['number']).columns) > 0:
-                            st.markdown("**Quick Statistics:**")
-                            st.json(df.describe().to_dict())
-                    else:
-                        st.info("No results found.")
+                if query_error:
+                    st.error(query_error)
+                    result_summary = query_error
+                else:
+                    display_results(df)
+                    result_summary = f"Results: {len(df)} rows returned"
                 
-                # Add to message history
+                # Add to message history, keeping the results (Parquet-encoded
+                # to stay compact) so reruns redraw them without re-querying
                 st.session_state.messages.append({
                     "role": "assistant",
-                    "content": f"SQL Query:\n```sql\n{sql_query}\n```\n\nResults: {len(df) if df is not None else 0} rows returned"
+                    "sql": sql_query,
+                    "df": None if query_error else encode_results(df),
+                    "content": f"{answer['explanation']}\n\nSQL Query:\n```sql\n{sql_query}\n```\n\n{result_summary}".lstrip()
                 })
             else:
                 st.error("Could not generate a valid SQL query. Please try rephrasing your question.")
+    
+    # Poll a background reset until it finishes
+    if st.session_state.get('reset_progress', {}).get('state') == 'running':
+        time.sleep(0.5)
+        st.rerun()
 
 if __name__ == "__main__":
     main()
@@ -0,0 +1,21 @@
+import asyncio
+import threading
+
+# Kept in an imported module rather than st.cache_resource: Streamlit's
+# "Clear cache" would otherwise start a second loop, while Gemini's
+# process-wide async client stays bound to the first one.
+_loop = None
+_lock = threading.Lock()
+
+def get_event_loop():
+    """Start one long-lived event loop in a background thread.
+    
+    Gemini's async client binds to the loop it was first used on, so every
+    coroutine is scheduled here rather than on a fresh asyncio.run() loop.
+    """
+    global _loop
+    with _lock:
+        if _loop is None:
+            _loop = asyncio.new_event_loop()
+            threading.Thread(target=_loop.run_forever, daemon=True).start()
+        return _loop
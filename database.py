@@ -1,13 +1,16 @@
-from sqlalchemy import create_engine, Column, Integer, String, Float, Date, ForeignKey, Text, DateTime
+from sqlalchemy import create_engine, event, select, func, Column, Integer, String, Float, Date, ForeignKey, Text, DateTime
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import relationship, sessionmaker
 from datetime import datetime, timedelta
-import random
-from faker import Faker
+import numpy as np
 import os
 
 Base = declarative_base()
 
+# Policy and claim numbers are derived from their primary keys, which keeps
+# them unique without Faker's rejection-sampling unique proxy
+NUMBER_BASE = 10_000_000
+
 class Address(Base):
     __tablename__ = 'addresses'
     address_id = Column(Integer, primary_key=True)
@@ -59,9 +62,9 @@ class Policy(Base):
     __tablename__ = 'policies'
     policy_id = Column(Integer, primary_key=True)
     policy_number = Column(String(50), unique=True)
-    customer_id = Column(Integer, ForeignKey('customers.customer_id'))
-    agent_id = Column(Integer, ForeignKey('agents.agent_id'))
-    type_id = Column(Integer, ForeignKey('policy_types.type_id'))
+    customer_id = Column(Integer, ForeignKey('customers.customer_id'), index=True)
+    agent_id = Column(Integer, ForeignKey('agents.agent_id'), index=True)
+    type_id = Column(Integer, ForeignKey('policy_types.type_id'), index=True)
     start_date = Column(Date)
     end_date = Column(Date)
     premium = Column(Float)
@@ -76,8 +79,8 @@ class Claim(Base):
     __tablename__ = 'claims'
     claim_id = Column(Integer, primary_key=True)
     claim_number = Column(String(50), unique=True)
-    policy_id = Column(Integer, ForeignKey('policies.policy_id'))
-    customer_id = Column(Integer, ForeignKey('customers.customer_id'))
+    policy_id = Column(Integer, ForeignKey('policies.policy_id'), index=True)
+    customer_id = Column(Integer, ForeignKey('customers.customer_id'), index=True)
     claim_date = Column(DateTime)
     description = Column(Text)
     amount_claimed = Column(Float)
@@ -99,148 +102,236 @@ class Prospect(Base):
     notes = Column(Text)
     created_date = Column(DateTime, default=datetime.utcnow)
 
+def _set_sqlite_read_pragma(dbapi_conn, _):
+    # Per-connection settings that help sorts, joins and aggregates
+    cursor = dbapi_conn.cursor()
+    cursor.execute("PRAGMA temp_store=MEMORY")
+    cursor.execute("PRAGMA cache_size=-65536")
+    cursor.close()
+
+def _set_sqlite_pragma(dbapi_conn, connection_record):
+    # WAL with synchronous=NORMAL avoids an fsync per commit
+    cursor = dbapi_conn.cursor()
+    cursor.execute("PRAGMA journal_mode=WAL")
+    cursor.execute("PRAGMA synchronous=NORMAL")
+    cursor.close()
+    _set_sqlite_read_pragma(dbapi_conn, connection_record)
+
+def make_engine(db_path='sqlite:///health_insurance.db'):
+    connect_args = {}
+    if db_path.startswith('sqlite'):
+        # Streamlit serves reruns from several threads
+        connect_args['check_same_thread'] = False
+    engine = create_engine(db_path, connect_args=connect_args)
+    if db_path.startswith('sqlite'):
+        # Read-only connections cannot switch the journal mode
+        read_only = 'mode=ro' in db_path
+        event.listen(engine, "connect", _set_sqlite_read_pragma if read_only else _set_sqlite_pragma)
+    return engine
+
 class Database:
-    def __init__(self, db_path='sqlite:///health_insurance.db'):
-        self.engine = create_engine(db_path)
+    def __init__(self, db_path='sqlite:///health_insurance.db', engine=None):
+        self.engine = engine if engine is not None else make_engine(db_path)
         self.Session = sessionmaker(bind=self.engine)
         
     def init_db(self):
         Base.metadata.create_all(self.engine)
+        # create_all skips existing tables, so add any indexes they predate
+        for table in Base.metadata.sorted_tables:
+            for index in table.indexes:
+                index.create(self.engine, checkfirst=True)
         
     def drop_tables(self):
         Base.metadata.drop_all(self.engine)
         
-    def create_sample_data(self, num_records=50):
+    def _next_id(self, conn, column):
+        return (conn.execute(select(func.max(column))).scalar() or 0) + 1
+        
+    def create_sample_data(self, num_records=50, seed=None):
+        # Only needed when generating data, so keep it off the app's import path
+        from faker import Faker
+        
         fake = Faker()
-        session = self.Session()
+        rng = np.random.default_rng(seed)
+        if seed is not None:
+            fake.seed_instance(seed)
+        
+        # Contact details are drawn up front for agents and customers (one per
+        # address, indexed alongside it) followed by the 20 prospects
+        num_people = num_records + 20
+        first_names = [fake.first_name() for _ in range(num_people)]
+        last_names = [fake.last_name() for _ in range(num_people)]
+        emails = [fake.email() for _ in range(num_people)]
+        phones = [fake.phone_number() for _ in range(num_people)]
         
         try:
-            # Create policy types
-            policy_types = [
-                PolicyType(
-                    name="Basic Health",
-                    description="Basic health insurance coverage",
-                    base_premium=200.0,
-                    coverage_limit=100000.0
-                ),
-                PolicyType(
-                    name="Family Plan",
-                    description="Health insurance for the whole family",
-                    base_premium=500.0,
-                    coverage_limit=500000.0
-                ),
-                PolicyType(
-                    name="Senior Care",
-                    description="Comprehensive coverage for seniors",
-                    base_premium=350.0,
-                    coverage_limit=300000.0
-                ),
-                PolicyType(
-                    name="Student Health",
-                    description="Affordable coverage for students",
-                    base_premium=150.0,
-                    coverage_limit=100000.0
-                )
-            ]
-            session.add_all(policy_types)
-            
-            # Create addresses
-            addresses = []
-            for _ in range(num_records):
-                address = Address(
-                    street_address=fake.street_address(),
-                    city=fake.city(),
-                    state=fake.state_abbr(),
-                    zip_code=fake.zipcode(),
-                    country='USA'
-                )
-                addresses.append(address)
-            session.add_all(addresses)
-            
-            # Create agents
-            agents = []
-            for i in range(5):
-                agent = Agent(
-                    first_name=fake.first_name(),
-                    last_name=fake.last_name(),
-                    email=fake.email(),
-                    phone=fake.phone_number(),
-                    hire_date=fake.date_between(start_date='-5y', end_date='today'),
-                    address=addresses[i]
-                )
-                agents.append(agent)
-            session.add_all(agents)
-            
-            # Create customers and policies
-            customers = []
-            for i in range(5, num_records):
-                customer = Customer(
-                    first_name=fake.first_name(),
-                    last_name=fake.last_name(),
-                    date_of_birth=fake.date_of_birth(minimum_age=18, maximum_age=90),
-                    email=fake.email(),
-                    phone=fake.phone_number(),
-                    ssn=fake.ssn(),
-                    address=addresses[i]
-                )
-                customers.append(customer)
+            # All rows are built as plain dicts with explicit primary keys and
+            # written with one executemany per table inside a single transaction
+            with self.engine.begin() as conn:
+                # Create policy types
+                type_start = self._next_id(conn, PolicyType.type_id)
+                policy_types = [
+                    dict(
+                        name="Basic Health",
+                        description="Basic health insurance coverage",
+                        base_premium=200.0,
+                        coverage_limit=100000.0
+                    ),
+                    dict(
+                        name="Family Plan",
+                        description="Health insurance for the whole family",
+                        base_premium=500.0,
+                        coverage_limit=500000.0
+                    ),
+                    dict(
+                        name="Senior Care",
+                        description="Comprehensive coverage for seniors",
+                        base_premium=350.0,
+                        coverage_limit=300000.0
+                    ),
+                    dict(
+                        name="Student Health",
+                        description="Affordable coverage for students",
+                        base_premium=150.0,
+                        coverage_limit=100000.0
+                    )
+                ]
+                for i, policy_type in enumerate(policy_types):
+                    policy_type['type_id'] = type_start + i
+                conn.execute(PolicyType.__table__.insert(), policy_types)
+                
+                # Create addresses
+                address_start = self._next_id(conn, Address.address_id)
+                addresses = [
+                    dict(
+                        address_id=address_start + i,
+                        street_address=fake.street_address(),
+                        city=fake.city(),
+                        state=fake.state_abbr(),
+                        zip_code=fake.zipcode(),
+                        country='USA'
+                    )
+                    for i in range(num_records)
+                ]
+                conn.execute(Address.__table__.insert(), addresses)
+                
+                # Create agents
+                agent_start = self._next_id(conn, Agent.agent_id)
+                agents = [
+                    dict(
+                        agent_id=agent_start + i,
+                        first_name=first_names[i],
+                        last_name=last_names[i],
+                        email=emails[i],
+                        phone=phones[i],
+                        hire_date=fake.date_between(start_date='-5y', end_date='today'),
+                        address_id=addresses[i]['address_id']
+                    )
+                    for i in range(5)
+                ]
+                conn.execute(Agent.__table__.insert(), agents)
                 
-                # Each customer gets 1-3 policies
-                for _ in range(random.randint(1, 3)):
-                    policy_type = random.choice(policy_types)
-                    start_date = fake.date_between(start_date='-2y', end_date='today')
-                    policy = Policy(
-                        policy_number=f"POL-{fake.unique.random_number(digits=8)}",
-                        customer=customer,
-                        agent=random.choice(agents),
-                        policy_type=policy_type,
-                        start_date=start_date,
-                        end_date=start_date + timedelta(days=365),
-                        premium=policy_type.base_premium * (0.8 + random.random() * 0.4),  # Randomize premium slightly
-                        status=random.choices(['Active', 'Expired', 'Cancelled'], weights=[0.8, 0.15, 0.05])[0]
+                # Draw every per-policy and per-claim random decision up front
+                num_customers = num_records - 5
+                coverage_limits = np.array([policy_type['coverage_limit'] for policy_type in policy_types])
+                policies_per_customer = rng.integers(1, 4, size=num_customers)  # Each customer gets 1-3 policies
+                total_policies = int(policies_per_customer.sum())
+                policy_type_idx = rng.integers(0, len(policy_types), size=total_policies)
+                policy_agent_idx = rng.integers(0, len(agents), size=total_policies).tolist()
+                policy_status = rng.choice(['Active', 'Expired', 'Cancelled'], size=total_policies, p=[0.8, 0.15, 0.05]).tolist()
+                premium_mult = (0.8 + rng.random(total_policies) * 0.4).tolist()  # Randomize premium slightly
+                # 30% chance of a policy having 1-4 claims
+                claims_per_policy = np.where(rng.random(total_policies) > 0.7, rng.integers(1, 5, size=total_policies), 0)
+                total_claims = int(claims_per_policy.sum())
+                amount_claimed = rng.uniform(100, np.repeat(coverage_limits[policy_type_idx], claims_per_policy) * 0.1)
+                amount_paid = (amount_claimed * rng.uniform(0.7, 1.0, size=total_claims)).tolist()
+                amount_claimed = amount_claimed.tolist()
+                claim_status = rng.choice(['Pending', 'Approved', 'Denied', 'Paid'], size=total_claims, p=[0.2, 0.3, 0.1, 0.4]).tolist()
+                policy_type_idx = policy_type_idx.tolist()
+                claims_per_policy = claims_per_policy.tolist()
+                
+                # Create customers and policies
+                customer_start = self._next_id(conn, Customer.customer_id)
+                policy_start = self._next_id(conn, Policy.policy_id)
+                claim_start = self._next_id(conn, Claim.claim_id)
+                customers = []
+                policies = []
+                claims = []
+                p = 0
+                c = 0
+                for i, num_policies in zip(range(5, num_records), policies_per_customer.tolist()):
+                    customer = dict(
+                        customer_id=customer_start + len(customers),
+                        first_name=first_names[i],
+                        last_name=last_names[i],
+                        date_of_birth=fake.date_of_birth(minimum_age=18, maximum_age=90),
+                        email=emails[i],
+                        phone=phones[i],
+                        ssn=fake.ssn(),
+                        address_id=addresses[i]['address_id']
                     )
-                    session.add(policy)
+                    customers.append(customer)
                     
-                    # Add claims for some policies
-                    if random.random() > 0.7:  # 30% chance of having claims
-                        for _ in range(random.randint(1, 4)):
-                            claim_date = fake.date_time_between(start_date=start_date, end_date='now')
-                            amount_claimed = random.uniform(100, policy_type.coverage_limit * 0.1)
-                            claim = Claim(
-                                claim_number=f"CLM-{fake.unique.random_number(digits=8)}",
-                                policy=policy,
-                                customer=customer,
-                                claim_date=claim_date,
+                    for _ in range(num_policies):
+                        policy_id = policy_start + p
+                        policy_type = policy_types[policy_type_idx[p]]
+                        start_date = fake.date_between(start_date='-2y', end_date='today')
+                        policies.append(dict(
+                            policy_id=policy_id,
+                            policy_number=f"POL-{NUMBER_BASE + policy_id:08d}",
+                            customer_id=customer['customer_id'],
+                            agent_id=agents[policy_agent_idx[p]]['agent_id'],
+                            type_id=policy_type['type_id'],
+                            start_date=start_date,
+                            end_date=start_date + timedelta(days=365),
+                            premium=policy_type['base_premium'] * premium_mult[p],
+                            status=policy_status[p]
+                        ))
+                        
+                        # Add claims for some policies
+                        for _ in range(claims_per_policy[p]):
+                            claim_id = claim_start + c
+                            claims.append(dict(
+                                claim_id=claim_id,
+                                claim_number=f"CLM-{NUMBER_BASE + claim_id:08d}",
+                                policy_id=policy_id,
+                                customer_id=customer['customer_id'],
+                                claim_date=fake.date_time_between(start_date=start_date, end_date='now'),
                                 description=fake.sentence(),
-                                amount_claimed=amount_claimed,
-                                amount_paid=amount_claimed * random.uniform(0.7, 1.0),
-                                status=random.choices(['Pending', 'Approved', 'Denied', 'Paid'], 
-                                                    weights=[0.2, 0.3, 0.1, 0.4])[0]
-                            )
-                            session.add(claim)
-            
-            # Create some prospects
-            for _ in range(20):
-                prospect = Prospect(
-                    first_name=fake.first_name(),
-                    last_name=fake.last_name(),
-                    email=fake.email(),
-                    phone=fake.phone_number(),
-                    source=random.choice(['Web', 'Referral', 'Advertisement', 'Cold Call', 'Email Campaign']),
-                    status=random.choice(['New', 'Contacted', 'Converted', 'Not Interested']),
-                    notes=fake.paragraph()
-                )
-                session.add(prospect)
+                                amount_claimed=amount_claimed[c],
+                                amount_paid=amount_paid[c],
+                                status=claim_status[c]
+                            ))
+                            c += 1
+                        p += 1
+                
+                conn.execute(Customer.__table__.insert(), customers)
+                conn.execute(Policy.__table__.insert(), policies)
+                if claims:
+                    conn.execute(Claim.__table__.insert(), claims)
+                
+                # Create some prospects
+                prospect_source = rng.choice(['Web', 'Referral', 'Advertisement', 'Cold Call', 'Email Campaign'], size=20).tolist()
+                prospect_status = rng.choice(['New', 'Contacted', 'Converted', 'Not Interested'], size=20).tolist()
+                prospects = [
+                    dict(
+                        first_name=first_names[i],
+                        last_name=last_names[i],
+                        email=emails[i],
+                        phone=phones[i],
+                        source=prospect_source[j],
+                        status=prospect_status[j],
+                        notes=fake.paragraph()
+                    )
+                    for j, i in enumerate(range(num_records, num_people))
+                ]
+                conn.execute(Prospect.__table__.insert(), prospects)
             
-            session.commit()
             print(f"Created {len(customers)} customers, {len(agents)} agents, and related records.")
             
         except Exception as e:
-            session.rollback()
             print(f"Error creating sample data: {e}")
             raise
-        finally:
-            session.close()
 
 if __name__ == "__main__":
     db = Database()